@@ -1,2 +1,20 @@
 # El modelo de IA recomendado para tareas de texto.
-GEMINI_TEXT_MODEL = "gemini-2.5-flash-preview-04-17"
\ No newline at end of file
+GEMINI_TEXT_MODEL = "gemini-2.5-flash-preview-04-17"
+
+# Índice local de similitud de perfiles ("vibra parecida").
+SIMILARITY_VECTOR_DIM = 256
+SIMILARITY_LSH_TABLES = 8
+SIMILARITY_LSH_BITS = 12
+SIMILARITY_BATCH_SIZE = 1000
+
+# Planificador de boosts y anuncios pagados.
+PROMOTION_SWEEP_INTERVAL_SECONDS = 60
+PROMOTION_SWEEP_BATCH_SIZE = 500
+# Huecos del feed reservados a perfiles/publicaciones promocionados.
+PROMOTED_SLOTS = 3
+
+# Mantenimiento periódico del índice de similitud (cambios de otros procesos).
+SIMILARITY_POLL_INTERVAL_SECONDS = 30
+SIMILARITY_POLL_OVERLAP_SECONDS = 60
+SIMILARITY_FULL_REBUILD_INTERVAL_SECONDS = 6 * 60 * 60
+SIMILARITY_REBUILD_RETRY_MAX_SECONDS = 300
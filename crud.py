@@ -1,6 +1,10 @@
+import random
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import and_, or_, not_
 import sql_models, schemas
+from constants import PROMOTED_SLOTS
+from services.similarity_service import profile_index
+from services.promotion_service import promotion_scheduler
 
 def get_user(db: Session, user_id: str) -> sql_models.User | None:
     """
@@ -12,22 +16,89 @@ def get_user(db: Session, user_id: str) -> sql_models.User | None:
         joinedload(sql_models.User.marketplace_listings)
     ).filter(sql_models.User.id == user_id).first()
 
-def get_discovery_profiles(db: Session, user_id: str) -> list[sql_models.User]:
+def get_discovery_profiles(db: Session, user_id: str, limit: int = 20) -> list[sql_models.User]:
     """
     Obtiene perfiles para el feed de "Descubrir".
     Excluye al propio usuario y a aquellos con los que ya hay una conexión.
+    Los primeros huecos se reservan a usuarios con logros en boost, tomados
+    del conjunto precalculado por el planificador de promociones.
     """
     connected_user_ids = db.query(sql_models.Connection.user_liked_id).filter(
         sql_models.Connection.user_liking_id == user_id
     )
 
-    return db.query(sql_models.User).options(
+    profiles = db.query(sql_models.User).options(
         joinedload(sql_models.User.achievements),
         joinedload(sql_models.User.marketplace_listings)
     ).filter(
         sql_models.User.id != user_id,
         not_(sql_models.User.id.in_(connected_user_ids))
-    ).order_by(sql_models.User.created_at.desc()).limit(20).all()
+    ).order_by(sql_models.User.created_at.desc()).limit(limit).all()
+
+    # Se piden más de los huecos disponibles por si alguno ya está conectado.
+    sample = _sample_promoted(promotion_scheduler.promoted_user_pool, exclude={user_id}, size=PROMOTED_SLOTS * 2)
+    if not sample:
+        return profiles
+
+    promoted = db.query(sql_models.User).options(
+        joinedload(sql_models.User.achievements),
+        joinedload(sql_models.User.marketplace_listings)
+    ).filter(
+        sql_models.User.id.in_(sample),
+        not_(sql_models.User.id.in_(connected_user_ids))
+    ).limit(PROMOTED_SLOTS).all()
+    return _blend_promoted(promoted, profiles, limit=limit)
+
+def get_marketplace_listings(db: Session, limit: int = 20) -> list[sql_models.MarketplaceListing]:
+    """
+    Obtiene las publicaciones más recientes del marketplace. Los anuncios
+    pagados vigentes (según el planificador de promociones) van primero.
+    """
+    listings = db.query(sql_models.MarketplaceListing).order_by(
+        sql_models.MarketplaceListing.date_added.desc()
+    ).limit(limit).all()
+
+    sample = _sample_promoted(promotion_scheduler.promoted_listing_pool, exclude=set(), size=PROMOTED_SLOTS)
+    if not sample:
+        return listings
+
+    promoted = db.query(sql_models.MarketplaceListing).filter(
+        sql_models.MarketplaceListing.id.in_(sample)
+    ).all()
+    return _blend_promoted(promoted, listings, limit=limit)
+
+def _sample_promoted(pool: tuple[str, ...], exclude: set[str], size: int) -> list[str]:
+    """
+    Muestra aleatoria (rota entre los promocionados en cada petición) sin los IDs
+    excluidos. Se piden `size + len(exclude)` para no tener que copiar el pool.
+    """
+    picked = random.sample(pool, min(len(pool), size + len(exclude)))
+    return [promoted_id for promoted_id in picked if promoted_id not in exclude][:size]
+
+def _blend_promoted(promoted: list, regular: list, limit: int) -> list:
+    """Coloca los elementos promocionados al principio sin duplicarlos."""
+    promoted_ids = {item.id for item in promoted}
+    return (promoted + [item for item in regular if item.id not in promoted_ids])[:limit]
+
+def get_similar_profiles(db: Session, user_id: str, limit: int = 20) -> list[sql_models.User]:
+    """
+    Obtiene los perfiles con "vibra parecida" (bio, ocupación e intereses)
+    usando el índice local de similitud. Excluye al propio usuario y a
+    aquellos con los que ya hay una conexión. Mantiene el orden por similitud.
+    """
+    connected_user_ids = {r.user_liked_id for r in db.query(sql_models.Connection.user_liked_id).filter(
+        sql_models.Connection.user_liking_id == user_id
+    )}
+    similar_ids = profile_index.most_similar(user_id, k=limit, exclude=connected_user_ids)
+    if not similar_ids:
+        return []
+
+    users = db.query(sql_models.User).options(
+        joinedload(sql_models.User.achievements),
+        joinedload(sql_models.User.marketplace_listings)
+    ).filter(sql_models.User.id.in_(similar_ids)).all()
+    users_by_id = {u.id: u for u in users}
+    return [users_by_id[uid] for uid in similar_ids if uid in users_by_id]
 
 def get_connections_for_user(db: Session, user_id: str) -> list[sql_models.User]:
     """
@@ -1,7 +1,7 @@
 import os
 import uvicorn
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException, Path
+from typing import List, Literal
+from fastapi import FastAPI, Depends, HTTPException, Path, Query
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from sqlalchemy import text
@@ -9,6 +9,8 @@ from sqlalchemy import text
 import crud, schemas, sql_models
 from database import SessionLocal, engine
 from ai_router import router as ai_router
+from services.similarity_service import profile_index
+from services.promotion_service import promotion_scheduler
 
 app = FastAPI(
     title="Vibrai Backend",
@@ -69,8 +71,17 @@ def on_startup():
             print(f"Base de datos poblada con {len(users_data)} usuarios.")
     finally:
         db.close()
+
+    # El índice de similitud se construye (y mantiene) en segundo plano para no retrasar el arranque.
+    profile_index.start()
+    promotion_scheduler.start()
     print("Preparación de la aplicación completa.")
 
+@app.on_event("shutdown")
+def on_shutdown():
+    promotion_scheduler.stop()
+    profile_index.stop()
+
 
 # --- Middlewares ---
 app.add_middleware(
@@ -102,8 +113,16 @@ def get_user_profile(db: Session = Depends(get_db)):
     return user
 
 @app.get("/api/matches", response_model=List[schemas.User], tags=["Perfiles"])
-def get_discovery_matches(db: Session = Depends(get_db)):
-    return crud.get_discovery_profiles(db, user_id="currentUser")
+def get_discovery_matches(
+    mode: Literal["discovery", "similar"] = Query("discovery"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    if mode == "similar":
+        if not profile_index.ready:
+            raise HTTPException(status_code=503, detail="El índice de similitud aún se está construyendo. Inténtalo en unos segundos.")
+        return crud.get_similar_profiles(db, user_id="currentUser", limit=limit)
+    return crud.get_discovery_profiles(db, user_id="currentUser", limit=limit)
 
 @app.get("/api/connections", response_model=List[schemas.User], tags=["Conexiones"])
 def get_user_connections(db: Session = Depends(get_db)):
@@ -127,6 +146,15 @@ def like_a_user(liked_user_id: str = Path(...), db: Session = Depends(get_db)):
     else:
         return schemas.LikeResponse(is_match=False)
 
+@app.get("/api/marketplace", response_model=List[schemas.MarketplaceListing], tags=["Marketplace"])
+def get_marketplace(limit: int = Query(20, ge=1, le=100), db: Session = Depends(get_db)):
+    return crud.get_marketplace_listings(db, limit=limit)
+
+@app.get("/api/metrics/promotions", response_model=schemas.PromotionMetrics, tags=["Métricas"])
+def get_promotion_metrics():
+    # Copia: los total_* se incrementan por lote mientras dura un barrido.
+    return dict(promotion_scheduler.metrics)
+
 # --- Incluir el router de IA ---
 app.include_router(ai_router)
 
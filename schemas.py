@@ -67,11 +67,28 @@ class LikeResponse(OrmModel):
     is_match: bool
     match_profile: Optional[User] = None
 
+class PromotionMetrics(OrmModel):
+    sweeps: int
+    last_sweep_at: Optional[datetime] = None
+    last_sweep_duration_ms: Optional[float] = None
+    last_expired_boosts: int
+    last_expired_ads: int
+    total_expired_boosts: int
+    total_expired_ads: int
+    promoted_users: int
+    promoted_listings: int
+    last_error: Optional[str] = None
+
 # --- Schemas para el Router de IA ---
 class ProfileAssistantRequest(BaseModel):
     user_message: str
     chat_history: List[Any]
 
+class ProfileAssistantResponse(BaseModel):
+    response_text: str = Field(..., alias='responseText')
+    generated_bio: Optional[str] = Field(None, alias='generatedBio')
+    is_profile_complete: bool = Field(..., alias='isProfileComplete')
+
 class GenerateInterestsRequest(BaseModel):
     bio_text: str = Field(..., alias='bioText')
 
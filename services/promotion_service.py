@@ -0,0 +1,156 @@
+import time
+import threading
+from datetime import datetime, timezone
+from sqlalchemy import select, update, func
+
+import sql_models
+from database import SessionLocal
+from constants import PROMOTION_SWEEP_INTERVAL_SECONDS, PROMOTION_SWEEP_BATCH_SIZE
+
+
+class PromotionScheduler:
+    """
+    Planificador en segundo plano de boosts (logros) y anuncios pagados (marketplace).
+
+    En cada ciclo:
+    - Caduca por lotes los boosts y anuncios cuya fecha de expiración ya pasó.
+    - Recalcula los conjuntos en memoria de usuarios y publicaciones promocionados,
+      que las consultas del feed usan sin añadir predicados de fecha por fila.
+    - Actualiza las métricas de duración del barrido y tamaño de los conjuntos.
+    """
+
+    def __init__(self, interval: float = PROMOTION_SWEEP_INTERVAL_SECONDS,
+                 batch_size: int = PROMOTION_SWEEP_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        # Se reemplazan completos (nunca se mutan), así la lectura no necesita bloqueo.
+        # Las tuplas permiten muestrear en el feed sin copiar el conjunto en cada petición.
+        self.promoted_user_ids: frozenset[str] = frozenset()
+        self.promoted_listing_ids: frozenset[str] = frozenset()
+        self.promoted_user_pool: tuple[str, ...] = ()
+        self.promoted_listing_pool: tuple[str, ...] = ()
+        # Sólo los total_* se incrementan en sitio (por lote confirmado); el resto
+        # se publica al final de cada barrido sustituyendo el diccionario entero.
+        self.metrics = {
+            "sweeps": 0,
+            "last_sweep_at": None,
+            "last_sweep_duration_ms": None,
+            "last_expired_boosts": 0,
+            "last_expired_ads": 0,
+            "total_expired_boosts": 0,
+            "total_expired_ads": 0,
+            "promoted_users": 0,
+            "promoted_listings": 0,
+            "last_error": None,
+        }
+
+    # --- Ciclo de vida ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="promotion-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            # Espera corta y fija: el apagado no debe depender del intervalo de barrido.
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    # --- Barrido ---
+    def run_once(self):
+        """
+        Ejecuta un barrido de caducidad y refresca los conjuntos promocionados.
+        Los totales se actualizan por lote confirmado; las métricas del barrido
+        se publican de una vez al terminar, también cuando el barrido falla.
+        """
+        started = time.perf_counter()
+        expired = {"boosts": 0, "ads": 0}
+        error = None
+        db = SessionLocal()
+        try:
+            self._expire_in_batches(
+                db, sql_models.Achievement,
+                sql_models.Achievement.is_boosted, sql_models.Achievement.boost_expiry_date,
+                expired, metric="boosts",
+            )
+            self._expire_in_batches(
+                db, sql_models.MarketplaceListing,
+                sql_models.MarketplaceListing.is_paid_ad, sql_models.MarketplaceListing.expiry_date,
+                expired, metric="ads",
+            )
+            self._refresh_promoted_sets(db)
+        except Exception as e:
+            db.rollback()
+            error = str(e)
+            print(f"Error en el barrido de promociones: {e}")
+        finally:
+            db.close()
+            duration_ms = (time.perf_counter() - started) * 1000
+            self.metrics = {
+                **self.metrics,
+                "sweeps": self.metrics["sweeps"] + 1,
+                "last_sweep_at": datetime.now(timezone.utc),
+                "last_sweep_duration_ms": round(duration_ms, 2),
+                "last_expired_boosts": expired["boosts"],
+                "last_expired_ads": expired["ads"],
+                "promoted_users": len(self.promoted_user_ids),
+                "promoted_listings": len(self.promoted_listing_ids),
+                "last_error": error,
+            }
+
+        if expired["boosts"] or expired["ads"]:
+            print(f"Barrido de promociones: {expired['boosts']} boosts y {expired['ads']} anuncios caducados en {duration_ms:.1f} ms.")
+
+    def _expire_in_batches(self, db, model, flag_column, expiry_column, expired: dict, metric: str) -> int:
+        """
+        Desactiva `flag_column` en las filas caducadas, en lotes de `batch_size`
+        con un commit por lote para no mantener bloqueos largos en la tabla.
+        FOR UPDATE SKIP LOCKED evita que dos workers barriendo a la vez se
+        bloqueen mutuamente: cada uno salta las filas que ya tiene el otro.
+        Cada lote confirmado se suma a `expired[metric]` y al total acumulado.
+        """
+        total = 0
+        while True:
+            expired_ids = select(model.id).where(
+                flag_column.is_(True),
+                expiry_column <= func.now()
+            ).order_by(model.id).limit(self.batch_size).with_for_update(skip_locked=True).scalar_subquery()
+            result = db.execute(
+                update(model)
+                .where(model.id.in_(expired_ids))
+                .values({flag_column.key: False})
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            total += result.rowcount
+            expired[metric] += result.rowcount
+            self.metrics[f"total_expired_{metric}"] += result.rowcount
+            if result.rowcount < self.batch_size:
+                return total
+
+    def _refresh_promoted_sets(self, db):
+        user_ids = db.execute(
+            select(sql_models.Achievement.user_id)
+            .where(sql_models.Achievement.is_boosted.is_(True))
+            .distinct()
+        ).scalars()
+        listing_ids = db.execute(
+            select(sql_models.MarketplaceListing.id)
+            .where(sql_models.MarketplaceListing.is_paid_ad.is_(True))
+        ).scalars()
+        self.promoted_user_pool = tuple(user_ids)
+        self.promoted_listing_pool = tuple(listing_ids)
+        self.promoted_user_ids = frozenset(self.promoted_user_pool)
+        self.promoted_listing_ids = frozenset(self.promoted_listing_pool)
+
+
+promotion_scheduler = PromotionScheduler()
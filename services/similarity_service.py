@@ -0,0 +1,485 @@
+import os
+import re
+import math
+import time
+import queue
+import hashlib
+import tempfile
+import threading
+import contextlib
+import unicodedata
+import numpy as np
+from datetime import timedelta
+from sqlalchemy import event, inspect, select, func
+
+import sql_models
+from database import SessionLocal
+from constants import (
+    SIMILARITY_VECTOR_DIM, SIMILARITY_LSH_TABLES, SIMILARITY_LSH_BITS,
+    SIMILARITY_BATCH_SIZE, SIMILARITY_POLL_INTERVAL_SECONDS, SIMILARITY_POLL_OVERLAP_SECONDS,
+    SIMILARITY_FULL_REBUILD_INTERVAL_SECONDS, SIMILARITY_REBUILD_RETRY_MAX_SECONDS,
+)
+
+INDEX_DIR = os.getenv('SIMILARITY_INDEX_DIR', '.vibrai_index')
+
+# Palabras vacías frecuentes que no aportan "vibra" al perfil.
+STOPWORDS = {
+    'para', 'por', 'con', 'sin', 'los', 'las', 'del', 'una', 'uno', 'unos', 'unas',
+    'que', 'como', 'mas', 'muy', 'pero', 'sus', 'mis', 'tus', 'the', 'and',
+    'soy', 'estoy', 'esta', 'este', 'esto', 'entre', 'sobre', 'todo', 'todos',
+}
+
+TOKEN_RE = re.compile(r'\w+')
+
+def _normalize(text: str) -> str:
+    """Pasa a minúsculas y elimina tildes para que 'Música' y 'musica' coincidan."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+def _hash_feature(feature: str, dim: int) -> tuple[int, float]:
+    """
+    Hash estable (no depende de PYTHONHASHSEED) que devuelve el índice de la
+    columna y el signo de la característica (hashing trick con signo).
+    """
+    digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+    return digest % dim, (1.0 if digest >> 63 else -1.0)
+
+def profile_features(user: sql_models.User, dim: int = SIMILARITY_VECTOR_DIM) -> dict[tuple[int, float], float]:
+    """
+    Extrae las características ponderadas de bio, ocupación e intereses.
+    Los intereses cuentan también como frase completa y pesan el doble.
+    """
+    counts: dict[tuple[int, float], float] = {}
+
+    def add(feature: str, weight: float):
+        key = _hash_feature(feature, dim)
+        counts[key] = counts.get(key, 0.0) + weight
+
+    texts = [user.bio or '', user.occupation or ''] + list(user.interests or [])
+    for text in texts:
+        for token in TOKEN_RE.findall(_normalize(text)):
+            if len(token) >= 3 and token not in STOPWORDS:
+                add(token, 1.0)
+    for interest in user.interests or []:
+        phrase = ' '.join(TOKEN_RE.findall(_normalize(interest)))
+        if phrase:
+            add(f'interes:{phrase}', 2.0)
+    return counts
+
+
+# Campos de User que alimentan el vector: cambios en otras columnas no reindexan.
+PROFILE_TEXT_FIELDS = ('bio', 'occupation', 'interests')
+
+# Mensajes de control para la cola del hilo de escritura.
+_WAKE = object()
+_STOP = object()
+
+
+class _IndexState:
+    """Filas, cubos LSH y matriz de vectores de un índice. Se sustituye entero al reconstruir."""
+
+    def __init__(self, n_tables: int, idf: np.ndarray):
+        self.idf = idf
+        self.ids: list[str | None] = []
+        self.rows: dict[str, int] = {}
+        self.free_rows: list[int] = []
+        self.buckets: list[dict[int, set[int]]] = [{} for _ in range(n_tables)]
+        # Matrices paralelas por fila: vectores (mapeados), firmas LSH (n_tables enteros)
+        # y generación, que cambia cada vez que la fila se libera o cambia de perfil.
+        self.vectors: np.memmap | None = None
+        self.signatures: np.ndarray | None = None
+        self.generations: np.ndarray | None = None
+        self.capacity = 0
+
+
+class ProfileIndex:
+    """
+    Índice local de similitud entre perfiles (sin red ni modelos externos).
+
+    - Vectoriza con TF-IDF sobre hashing (TF sublineal, vectores L2-normalizados).
+    - Guarda los vectores en una matriz float32 mapeada en memoria (np.memmap).
+    - Usa LSH de hiperplanos aleatorios (varias tablas) como índice aproximado;
+      sólo se puntúan exactamente los candidatos de los cubos consultados.
+
+    Todas las escrituras las hace un único hilo (el de `start()`), que atiende una
+    cola con los IDs de perfiles modificados tras cada commit (vía rápida) y, cada
+    cierto tiempo, busca en la BD perfiles cambiados por otros procesos y hace una
+    reconstrucción completa. Las consultas sólo toman el bloqueo para copiar lo
+    imprescindible; la puntuación se hace fuera.
+
+    El IDF se calcula en cada reconstrucción completa y se mantiene fijo en las
+    actualizaciones incrementales hasta la siguiente reconstrucción.
+    """
+
+    def __init__(self, index_dir: str = INDEX_DIR, dim: int = SIMILARITY_VECTOR_DIM,
+                 n_tables: int = SIMILARITY_LSH_TABLES, n_bits: int = SIMILARITY_LSH_BITS):
+        self.index_dir = index_dir
+        self.dim = dim
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self._lock = threading.Lock()
+        # Semilla fija: las firmas LSH son reproducibles entre reinicios.
+        rng = np.random.default_rng(20240611)
+        self._planes = rng.standard_normal((n_tables * n_bits, dim)).astype(np.float32)
+        self._bit_weights = (1 << np.arange(n_bits, dtype=np.int64))
+        # Máscaras XOR del multi-probe: cubo exacto, vecinos a 1 bit y a 2 bits.
+        single = [1 << b for b in range(n_bits)]
+        self._probes_1 = [0] + single
+        self._probes_2 = self._probes_1 + [a | b for i, a in enumerate(single) for b in single[i + 1:]]
+        self._state = _IndexState(n_tables, np.ones(dim, dtype=np.float32))
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        # False hasta que termina la primera reconstrucción completa.
+        self.ready = False
+        # Planificación del hilo de escritura (en time.monotonic()).
+        self._rebuild_due_at = 0.0
+        self._poll_due_at = math.inf
+        self._retry_delay = 0.0
+        # max(updated_at, created_at) de User visto en la última lectura de la BD.
+        self._watermark = None
+
+    @property
+    def size(self) -> int:
+        return len(self._state.rows)
+
+    # --- Hilo de escritura ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="similarity-index", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._queue.put(_STOP)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def request_rebuild(self):
+        self._rebuild_due_at = 0.0
+        self._queue.put(_WAKE)
+
+    def enqueue(self, user_ids: set[str]):
+        """Programa la relectura de estos perfiles en el hilo del índice."""
+        self._queue.put(set(user_ids))
+
+    def _run(self):
+        while True:
+            timeout = max(0.0, min(self._rebuild_due_at, self._poll_due_at) - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = _WAKE
+            if item is _STOP:
+                return
+            try:
+                if item is not _WAKE:
+                    self._refresh_users(item)
+                self._maintain()
+            except Exception as e:
+                print(f"Error al actualizar el índice de similitud: {e}")
+
+    def _maintain(self):
+        """
+        Tareas periódicas del hilo de escritura:
+        - Reconstrucción completa al arrancar y cada SIMILARITY_FULL_REBUILD_INTERVAL_SECONDS
+          (recoge borrados y recalcula el IDF). Si falla se reintenta con espera exponencial.
+        - Entre reconstrucciones, relee los perfiles cuya marca de tiempo supera la
+          última vista: cambios hechos por otros workers, scripts u otros servicios.
+        """
+        now = time.monotonic()
+        if now >= self._rebuild_due_at:
+            try:
+                self._rebuild_from_db()
+            except Exception as e:
+                self._retry_delay = min(max(self._retry_delay * 2, 1.0), SIMILARITY_REBUILD_RETRY_MAX_SECONDS)
+                self._rebuild_due_at = now + self._retry_delay
+                print(f"Error al reconstruir el índice de similitud (reintento en {self._retry_delay:.0f} s): {e}")
+                return
+            self._retry_delay = 0.0
+            self._rebuild_due_at = now + SIMILARITY_FULL_REBUILD_INTERVAL_SECONDS
+            self._poll_due_at = now + SIMILARITY_POLL_INTERVAL_SECONDS
+        elif now >= self._poll_due_at:
+            # Se reprograma antes de consultar: un fallo no provoca un bucle de reintentos.
+            self._poll_due_at = now + SIMILARITY_POLL_INTERVAL_SECONDS
+            self._poll_changes()
+
+    def _rebuild_from_db(self):
+        db = SessionLocal()
+        try:
+            self.rebuild(db)
+        finally:
+            db.close()
+
+    def _poll_changes(self):
+        """
+        Relee los perfiles con max(updated_at, created_at) posterior a la marca de agua.
+        Se solapa SIMILARITY_POLL_OVERLAP_SECONDS hacia atrás porque updated_at toma la
+        hora de inicio de la transacción, que puede confirmarse después de la lectura.
+        """
+        if self._watermark is None:
+            return
+        changed_at = func.coalesce(sql_models.User.updated_at, sql_models.User.created_at)
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(sql_models.User.id, changed_at)
+                .where(changed_at >= self._watermark - timedelta(seconds=SIMILARITY_POLL_OVERLAP_SECONDS))
+            ).all()
+        finally:
+            db.close()
+        if not rows:
+            return
+        user_ids = [user_id for user_id, _ in rows]
+        for start in range(0, len(user_ids), SIMILARITY_BATCH_SIZE):
+            self._refresh_users(set(user_ids[start:start + SIMILARITY_BATCH_SIZE]))
+        self._watermark = max(self._watermark, max(ts for _, ts in rows))
+
+    def _read_watermark(self, db):
+        changed_at = func.coalesce(sql_models.User.updated_at, sql_models.User.created_at)
+        return db.execute(select(func.max(changed_at))).scalar()
+
+    def _refresh_users(self, user_ids: set[str]):
+        """Relee de la BD los perfiles modificados; los que ya no existen salen del índice."""
+        db = SessionLocal()
+        try:
+            users = db.query(sql_models.User).filter(sql_models.User.id.in_(user_ids)).all()
+        finally:
+            db.close()
+        self.upsert_many(users)
+        for user_id in set(user_ids) - {u.id for u in users}:
+            self.remove(user_id)
+
+    # --- Almacenamiento ---
+    def _new_vectors(self, capacity: int) -> np.memmap:
+        """
+        Crea la matriz mapeada sobre un fichero temporal propio del proceso y lo
+        borra nada más mapearlo: varios workers nunca comparten la misma matriz
+        y no quedan restos en disco.
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix='vectors-', suffix='.f32', dir=self.index_dir)
+        try:
+            with os.fdopen(fd, 'w+b') as f:
+                return np.memmap(f, dtype=np.float32, mode='w+', shape=(capacity, self.dim))
+        finally:
+            os.unlink(path)
+
+    def _ensure_capacity(self, state: _IndexState, needed: int, lock):
+        """Crece las matrices de vectores y firmas (duplicando capacidad) si no caben `needed` filas."""
+        if needed <= state.capacity:
+            return
+        capacity = max(1024, state.capacity)
+        while capacity < needed:
+            capacity *= 2
+        vectors = self._new_vectors(capacity)
+        signatures = np.zeros((capacity, self.n_tables), dtype=np.int32)
+        generations = np.zeros(capacity, dtype=np.uint32)
+        if state.vectors is not None:
+            # Sólo escribe este hilo: copiar fuera del bloqueo no frena las consultas.
+            vectors[:state.capacity] = state.vectors[:state.capacity]
+            signatures[:state.capacity] = state.signatures[:state.capacity]
+            generations[:state.capacity] = state.generations[:state.capacity]
+        with lock:
+            state.vectors, state.signatures, state.generations = vectors, signatures, generations
+            state.capacity = capacity
+
+    # --- Vectorización ---
+    def _vectorize(self, users: list[sql_models.User], idf: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Devuelve la matriz (n, dim) normalizada y una máscara de perfiles con texto."""
+        matrix = np.zeros((len(users), self.dim), dtype=np.float32)
+        for i, user in enumerate(users):
+            for (col, sign), count in profile_features(user, self.dim).items():
+                matrix[i, col] += sign * (1.0 + math.log(count))
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1)
+        has_text = norms > 0
+        matrix[has_text] /= norms[has_text, None]
+        return matrix, has_text
+
+    def _signature(self, matrix: np.ndarray) -> np.ndarray:
+        """Firma LSH por tabla: (n, n_tables) con enteros de n_bits bits."""
+        bits = (matrix @ self._planes.T > 0).reshape(len(matrix), self.n_tables, self.n_bits)
+        return (bits.astype(np.int64) @ self._bit_weights).astype(np.int32)
+
+    # --- Construcción y actualización ---
+    def rebuild(self, db):
+        """
+        Reconstruye el índice completo leyendo los usuarios por lotes.
+        Primera pasada: frecuencias de documento para el IDF. Segunda: vectores.
+        El índice nuevo se construye aparte y sustituye al actual de una vez,
+        así las consultas nunca ven un índice a medio llenar.
+        """
+        # La marca de agua se lee antes: lo que cambie durante la reconstrucción
+        # lo recoge la siguiente consulta periódica.
+        watermark = self._read_watermark(db)
+        doc_freq = np.zeros(self.dim, dtype=np.int64)
+        total = 0
+        query = db.query(sql_models.User).order_by(sql_models.User.id)
+        for user in query.yield_per(SIMILARITY_BATCH_SIZE):
+            cols = {col for col, _ in profile_features(user, self.dim)}
+            if cols:
+                doc_freq[list(cols)] += 1
+                total += 1
+            db.expunge(user)
+
+        idf = (np.log((1 + total) / (1 + doc_freq)) + 1).astype(np.float32)
+        state = _IndexState(self.n_tables, idf)
+        # Nadie más ve `state` hasta el cambio final: no hace falta bloqueo.
+        no_lock = contextlib.nullcontext()
+        batch: list[sql_models.User] = []
+        for user in query.yield_per(SIMILARITY_BATCH_SIZE):
+            batch.append(user)
+            if len(batch) >= SIMILARITY_BATCH_SIZE:
+                self._apply(state, batch, no_lock)
+                for u in batch:
+                    db.expunge(u)
+                batch = []
+        if batch:
+            self._apply(state, batch, no_lock)
+
+        with self._lock:
+            self._state = state
+            self.ready = True
+        if watermark is not None:
+            self._watermark = watermark
+        print(f"Índice de similitud reconstruido con {self.size} perfiles.")
+
+    def upsert(self, user: sql_models.User):
+        """Añade o actualiza un perfil en el índice (actualización incremental)."""
+        self.upsert_many([user])
+
+    def upsert_many(self, users: list[sql_models.User]):
+        """Como `upsert`, por lotes. Debe llamarse siempre desde un único hilo escritor."""
+        self._apply(self._state, users, self._lock)
+
+    def remove(self, user_id: str):
+        with self._lock:
+            self._remove_row(self._state, user_id)
+
+    def _apply(self, state: _IndexState, users: list[sql_models.User], lock):
+        matrix, has_text = self._vectorize(users, state.idf)
+        signatures = self._signature(matrix)
+        self._ensure_capacity(state, len(state.ids) + int(has_text.sum()), lock)
+        with lock:
+            for user, ok, vector, signature in zip(users, has_text, matrix, signatures):
+                if not ok:
+                    # Perfil sin texto útil: sale del índice.
+                    self._remove_row(state, user.id)
+                    continue
+                row = state.rows.get(user.id)
+                if row is not None:
+                    self._unlink(state, row)
+                elif state.free_rows:
+                    row = state.free_rows.pop()
+                    state.ids[row] = user.id
+                    state.generations[row] += 1
+                else:
+                    row = len(state.ids)
+                    state.ids.append(user.id)
+                state.rows[user.id] = row
+                state.vectors[row] = vector
+                state.signatures[row] = signature
+                for table, key in enumerate(signature):
+                    state.buckets[table].setdefault(int(key), set()).add(row)
+
+    def _unlink(self, state: _IndexState, row: int):
+        """Saca la fila de sus cubos LSH (la fila debe estar indexada)."""
+        for table, key in enumerate(state.signatures[row]):
+            bucket = state.buckets[table].get(int(key))
+            if bucket is not None:
+                bucket.discard(row)
+                if not bucket:
+                    del state.buckets[table][int(key)]
+
+    def _remove_row(self, state: _IndexState, user_id: str):
+        row = state.rows.pop(user_id, None)
+        if row is None:
+            return
+        self._unlink(state, row)
+        state.vectors[row] = 0
+        state.generations[row] += 1
+        state.ids[row] = None
+        state.free_rows.append(row)
+
+    # --- Consulta ---
+    def most_similar(self, user_id: str, k: int = 20, exclude: set[str] | None = None) -> list[str]:
+        """
+        Devuelve hasta `k` IDs de perfiles con vibra parecida a `user_id`,
+        ordenados por similitud coseno descendente.
+        """
+        exclude = set(exclude or ()) | {user_id}
+        # Bajo el bloqueo sólo se copian el vector consulta, las filas candidatas
+        # y sus generaciones; la lectura de la matriz y el producto se hacen fuera.
+        with self._lock:
+            state = self._state
+            row = state.rows.get(user_id)
+            if row is None:
+                return []
+            vectors = state.vectors
+            query = np.array(vectors[row])
+            signature = state.signatures[row].copy()
+            excluded_rows = {state.rows[uid] for uid in exclude if uid in state.rows}
+            candidates = self._candidates(state, signature, self._probes_1) - excluded_rows
+            if len(candidates) < k:
+                # Pocos candidatos: se amplía el multi-probe a 2 bits en vez de recorrer toda la matriz.
+                candidates = self._candidates(state, signature, self._probes_2) - excluded_rows
+            if not candidates:
+                return []
+            # Filas ordenadas: lectura secuencial de la matriz mapeada.
+            rows = np.sort(np.fromiter(candidates, dtype=np.int64, count=len(candidates)))
+            generations = state.generations[rows]
+
+        scores = vectors[rows] @ query
+        top = np.argpartition(-scores, min(k, len(rows)) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        # Mientras se puntuaba, el hilo escritor pudo borrar o reutilizar filas:
+        # sólo se devuelven las que siguen perteneciendo al mismo perfil.
+        with self._lock:
+            return [
+                state.ids[rows[i]] for i in top
+                if scores[i] > 0 and state.generations[rows[i]] == generations[i]
+            ]
+
+    def _candidates(self, state: _IndexState, signature: np.ndarray, probes: list[int]) -> set[int]:
+        """Une los cubos de cada tabla a distancia `probes` (máscaras XOR) de la firma."""
+        candidates: set[int] = set()
+        for table, key in enumerate(signature):
+            key = int(key)
+            buckets = state.buckets[table]
+            for mask in probes:
+                candidates.update(buckets.get(key ^ mask, ()))
+        return candidates
+
+
+profile_index = ProfileIndex()
+
+# --- Actualización incremental cuando cambian los perfiles ---
+# Los IDs se recogen en cada flush y sólo se encolan tras el commit. El hilo del
+# índice relee los perfiles: un rollback nunca deja vectores sin confirmar y la
+# escritura del usuario no depende del índice.
+_DIRTY_KEY = 'similarity_dirty_user_ids'
+
+def _profile_text_changed(user: sql_models.User) -> bool:
+    attrs = inspect(user).attrs
+    return any(attrs[field].history.has_changes() for field in PROFILE_TEXT_FIELDS)
+
+@event.listens_for(SessionLocal, 'after_flush')
+def _collect_profile_changes(session, flush_context):
+    dirty = session.info.setdefault(_DIRTY_KEY, set())
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, sql_models.User):
+            dirty.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, sql_models.User) and _profile_text_changed(obj):
+            dirty.add(obj.id)
+
+@event.listens_for(SessionLocal, 'after_commit')
+def _enqueue_profile_changes(session):
+    user_ids = session.info.pop(_DIRTY_KEY, None)
+    if user_ids:
+        profile_index.enqueue(user_ids)
+
+@event.listens_for(SessionLocal, 'after_rollback')
+def _discard_profile_changes(session):
+    session.info.pop(_DIRTY_KEY, None)
@@ -0,0 +1,40 @@
+import os
+import sys
+
+# database.py exige DATABASE_URL al importarse; los tests no usan Postgres.
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.compiler import compiles
+
+import database
+import sql_models
+
+
+# SQLite no tiene ARRAY: basta con poder crear la tabla (los tests dejan esas columnas a None).
+@compiles(ARRAY, "sqlite")
+def _compile_array_sqlite(type_, compiler, **kw):
+    return "TEXT"
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'vibrai.db'}")
+    sql_models.Base.metadata.create_all(engine, tables=[
+        sql_models.User.__table__,
+        sql_models.Connection.__table__,
+        sql_models.Achievement.__table__,
+        sql_models.MarketplaceListing.__table__,
+    ])
+    return engine
+
+
+@pytest.fixture
+def db(sqlite_engine):
+    # Sesión de la fábrica real, así se disparan los listeners registrados en SessionLocal.
+    session = database.SessionLocal(bind=sqlite_engine)
+    yield session
+    session.close()
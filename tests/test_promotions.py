@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import sql_models
+from services import promotion_service
+from services.promotion_service import PromotionScheduler
+
+
+def item(item_id):
+    return SimpleNamespace(id=item_id)
+
+
+# --- Mezcla de promocionados en los resultados ---
+def test_blend_puts_promoted_first_without_duplicates():
+    promoted = [item("p1"), item("r2")]
+    regular = [item("r1"), item("r2"), item("r3")]
+
+    result = crud._blend_promoted(promoted, regular, limit=10)
+
+    assert [i.id for i in result] == ["p1", "r2", "r1", "r3"]
+
+
+def test_blend_respects_limit():
+    promoted = [item("p1"), item("p2")]
+    regular = [item(f"r{i}") for i in range(5)]
+
+    result = crud._blend_promoted(promoted, regular, limit=3)
+
+    assert [i.id for i in result] == ["p1", "p2", "r0"]
+
+
+def test_sample_promoted_excludes_caller_and_caps_size():
+    pool = ("currentUser", "a", "b", "c")
+
+    for _ in range(20):
+        sample = crud._sample_promoted(pool, exclude={"currentUser"}, size=2)
+        assert len(sample) == 2
+        assert "currentUser" not in sample
+        assert set(sample) <= {"a", "b", "c"}
+    assert crud._sample_promoted(("currentUser",), exclude={"currentUser"}, size=3) == []
+    assert crud._sample_promoted((), exclude=set(), size=3) == []
+
+
+# --- Barrido de caducidad ---
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'promos.db'}")
+    sql_models.Base.metadata.create_all(
+        engine, tables=[sql_models.Achievement.__table__, sql_models.MarketplaceListing.__table__]
+    )
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(promotion_service, "SessionLocal", factory)
+    factory.engine = engine
+    return factory
+
+
+def count_updates(engine, table):
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith(f"UPDATE {table}"):
+            statements.append(statement)
+
+    return statements
+
+
+def add_boosts(factory, expired, active):
+    past = datetime.utcnow() - timedelta(days=1)
+    future = datetime.utcnow() + timedelta(days=1)
+    db = factory()
+    for i in range(expired + active):
+        db.add(sql_models.Achievement(
+            id=f"a{i}", user_id=f"u{i}", category="vida", description="logro",
+            is_boosted=True, boost_expiry_date=past if i < expired else future,
+        ))
+    db.commit()
+    db.close()
+
+
+@pytest.mark.parametrize("expired, expected_batches", [(0, 1), (3, 2), (4, 3), (5, 3)])
+def test_sweep_stops_after_first_short_batch(session_factory, expired, expected_batches):
+    add_boosts(session_factory, expired=expired, active=2)
+    updates = count_updates(session_factory.engine, "achievements")
+    scheduler = PromotionScheduler(batch_size=2)
+
+    scheduler.run_once()
+
+    assert len(updates) == expected_batches
+    assert scheduler.metrics["last_expired_boosts"] == expired
+    assert scheduler.metrics["total_expired_boosts"] == expired
+    assert scheduler.promoted_user_ids == {f"u{i}" for i in range(expired, expired + 2)}
+    assert scheduler.metrics["promoted_users"] == 2
+    assert scheduler.metrics["last_error"] is None
+
+
+def test_failed_sweep_keeps_committed_batches_and_duration(session_factory):
+    add_boosts(session_factory, expired=3, active=0)
+    sql_models.MarketplaceListing.__table__.drop(session_factory.engine)
+    scheduler = PromotionScheduler(batch_size=2)
+
+    scheduler.run_once()
+
+    assert scheduler.metrics["last_error"]
+    assert scheduler.metrics["total_expired_boosts"] == 3
+    assert scheduler.metrics["last_sweep_duration_ms"] is not None
+    assert scheduler.metrics["last_sweep_at"] is not None
+    assert scheduler.metrics["sweeps"] == 1
+
+
+def test_metrics_are_published_as_one_snapshot(session_factory):
+    add_boosts(session_factory, expired=3, active=0)
+    scheduler = PromotionScheduler(batch_size=2)
+    scheduler.run_once()
+    first = scheduler.metrics
+    seen_mid_sweep = []
+
+    @event.listens_for(session_factory.engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen_mid_sweep.append(scheduler.metrics)
+
+    scheduler.run_once()
+
+    # Durante el segundo barrido se sigue viendo entero el primero.
+    assert seen_mid_sweep
+    for snapshot in seen_mid_sweep:
+        assert snapshot["last_expired_boosts"] == first["last_expired_boosts"] == 3
+        assert snapshot["last_sweep_at"] == first["last_sweep_at"]
+    assert scheduler.metrics["last_expired_boosts"] == 0
+    assert scheduler.metrics["total_expired_boosts"] == 3
+    assert scheduler.metrics["sweeps"] == 2
+
+
+# --- crud con promocionados ---
+def add_user(db, user_id):
+    db.add(sql_models.User(id=user_id, name=user_id, age=30, bio="hola"))
+
+
+def boost(db, user_id):
+    db.add(sql_models.Achievement(
+        id=f"boost-{user_id}", user_id=user_id, category="vida", description="logro",
+        is_boosted=True, boost_expiry_date=datetime.utcnow() + timedelta(days=1),
+    ))
+
+
+@pytest.fixture
+def scheduler_on(monkeypatch):
+    def install(db):
+        scheduler = PromotionScheduler()
+        scheduler._refresh_promoted_sets(db)
+        monkeypatch.setattr(crud, "promotion_scheduler", scheduler)
+        return scheduler
+    return install
+
+
+def test_discovery_blends_promoted_but_excludes_caller_and_connected(db, scheduler_on):
+    for user_id in ("currentUser", "liked", "boosted", "plain1", "plain2"):
+        add_user(db, user_id)
+    for user_id in ("currentUser", "liked", "boosted"):
+        boost(db, user_id)
+    db.add(sql_models.Connection(user_liking_id="currentUser", user_liked_id="liked", status="liked"))
+    db.commit()
+    scheduler_on(db)
+
+    for _ in range(5):
+        ids = [u.id for u in crud.get_discovery_profiles(db, user_id="currentUser")]
+        assert ids[0] == "boosted"
+        assert sorted(ids) == ["boosted", "plain1", "plain2"]
+
+    assert len(crud.get_discovery_profiles(db, user_id="currentUser", limit=2)) == 2
+
+
+def test_marketplace_puts_paid_ads_first(db, scheduler_on):
+    add_user(db, "seller")
+    now = datetime.utcnow()
+    for i, paid in enumerate([True, False, False]):
+        db.add(sql_models.MarketplaceListing(
+            id=f"l{i}", user_id="seller", type="otro", title="t", description="d",
+            is_paid_ad=paid, date_added=now + timedelta(minutes=i),
+        ))
+    db.commit()
+    scheduler_on(db)
+
+    ids = [listing.id for listing in crud.get_marketplace_listings(db, limit=3)]
+
+    assert ids == ["l0", "l2", "l1"]
+    assert [listing.id for listing in crud.get_marketplace_listings(db, limit=1)] == ["l0"]
@@ -0,0 +1,299 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import crud
+import database
+import main
+import sql_models
+from services import similarity_service
+from services.similarity_service import ProfileIndex
+
+
+def make_user(user_id, bio=None, occupation=None, interests=None):
+    return SimpleNamespace(id=user_id, bio=bio, occupation=occupation, interests=interests or [])
+
+
+@pytest.fixture
+def index(tmp_path):
+    # Con 2 bits por tabla el multi-probe a 2 bits cubre todos los cubos:
+    # los tests no dependen de colisiones LSH concretas.
+    return ProfileIndex(index_dir=str(tmp_path), dim=64, n_tables=2, n_bits=2)
+
+
+def test_most_similar_orders_by_similarity(index):
+    index.upsert_many([
+        make_user("me", bio="Senderismo por la montaña y café de especialidad", interests=["Senderismo", "Café"]),
+        make_user("twin", bio="Senderismo en la montaña y café", interests=["Senderismo", "Café"]),
+        make_user("half", bio="Café por las mañanas", interests=["Café", "Cine"]),
+        make_user("other", bio="Videojuegos retro y programación", interests=["Videojuegos"]),
+    ])
+
+    result = index.most_similar("me", k=3)
+
+    assert result[:2] == ["twin", "half"]
+    assert "me" not in result
+
+
+def test_most_similar_excludes_self_and_connected(index):
+    index.upsert_many([
+        make_user("me", interests=["Yoga", "Playa"]),
+        make_user("liked", interests=["Yoga", "Playa"]),
+        make_user("new", interests=["Yoga"]),
+    ])
+
+    assert index.most_similar("me", k=5, exclude={"liked"}) == ["new"]
+
+
+def test_most_similar_unknown_user_returns_empty(index):
+    assert index.most_similar("missing") == []
+
+
+def test_remove_frees_row_for_reuse(index):
+    index.upsert_many([make_user("a", bio="arte"), make_user("b", bio="arte"), make_user("c", bio="arte")])
+    freed_row = index._state.rows["b"]
+
+    index.remove("b")
+    assert "b" not in index.most_similar("a")
+    assert index.size == 2
+
+    index.upsert(make_user("d", bio="arte"))
+    assert index._state.rows["d"] == freed_row
+    assert set(index.most_similar("a")) == {"c", "d"}
+
+
+def test_upsert_without_text_unindexes_user(index):
+    index.upsert_many([make_user("a", bio="música indie"), make_user("b", bio="música indie")])
+
+    index.upsert(make_user("b", bio="", occupation=None, interests=[]))
+
+    assert index.size == 1
+    assert index.most_similar("a") == []
+    assert index.most_similar("b") == []
+
+
+def test_grows_past_initial_capacity(index):
+    users = [make_user(f"u{i}", bio=f"fotografía viajes tema{i % 7}") for i in range(1100)]
+    index.upsert_many(users[:600])
+    index.upsert_many(users[600:])
+
+    assert index.size == 1100
+    assert index._state.capacity >= 1100
+    # Las filas copiadas al crecer siguen siendo consultables.
+    assert index.most_similar("u0", k=5)
+    assert index.most_similar("u1099", k=5)
+
+
+class FakeQuery:
+    def __init__(self, users, on_iterate):
+        self.users = users
+        self.on_iterate = on_iterate
+
+    def order_by(self, *args):
+        return self
+
+    def yield_per(self, n):
+        for user in self.users:
+            self.on_iterate()
+            yield user
+
+
+class FakeSession:
+    def __init__(self, query):
+        self._query = query
+
+    def query(self, model):
+        return self._query
+
+    def execute(self, statement):
+        # Marca de agua: sin usuarios con fecha.
+        return SimpleNamespace(scalar=lambda: None)
+
+    def expunge(self, obj):
+        pass
+
+
+def test_rebuild_swaps_in_new_index_atomically(index):
+    index.upsert_many([make_user("old_a", bio="surf playa"), make_user("old_b", bio="surf playa")])
+    seen_during_rebuild = []
+    new_users = [make_user("new_a", bio="ajedrez lectura"), make_user("new_b", bio="ajedrez lectura")]
+    db = FakeSession(FakeQuery(new_users, lambda: seen_during_rebuild.append(index.most_similar("old_a"))))
+
+    assert not index.ready
+    index.rebuild(db)
+
+    # Mientras se reconstruye, las consultas siguen viendo el índice anterior completo.
+    assert seen_during_rebuild and all(r == ["old_b"] for r in seen_during_rebuild)
+    assert index.ready
+    assert index.most_similar("old_a") == []
+    assert index.most_similar("new_a") == ["new_b"]
+
+
+# --- Reintentos y mantenimiento periódico ---
+def test_failed_rebuild_is_retried_with_backoff(index, monkeypatch):
+    attempts = []
+
+    def flaky_rebuild():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("BD no disponible")
+        index.ready = True
+
+    monkeypatch.setattr(index, "_rebuild_from_db", flaky_rebuild)
+
+    index._maintain()
+    assert not index.ready and index._retry_delay == 1
+    index._rebuild_due_at = 0
+    index._maintain()
+    assert not index.ready and index._retry_delay == 2
+
+    index._rebuild_due_at = 0
+    index._maintain()
+    assert index.ready
+    assert index._retry_delay == 0
+    assert len(attempts) == 3
+
+
+def add_user(db, user_id, **fields):
+    db.add(sql_models.User(id=user_id, name=user_id, age=30, **fields))
+
+
+@pytest.fixture
+def index_on_sqlite(index, sqlite_engine, monkeypatch):
+    monkeypatch.setattr(similarity_service, "SessionLocal", lambda: database.SessionLocal(bind=sqlite_engine))
+    return index
+
+
+def test_poll_picks_up_changes_from_other_processes(index_on_sqlite, db):
+    index = index_on_sqlite
+    add_user(db, "a", bio="jazz vinilos conciertos")
+    add_user(db, "b", bio="surf playa")
+    db.commit()
+    index._rebuild_from_db()
+    assert index.most_similar("a") == []
+
+    # Escritura "externa": otro worker o un script. No pasa por la cola de este índice.
+    db.get(sql_models.User, "b").bio = "jazz vinilos"
+    add_user(db, "c", bio="conciertos de jazz")
+    db.commit()
+    index._queue.queue.clear()
+    index._poll_changes()
+
+    assert set(index.most_similar("a")) == {"b", "c"}
+
+
+def test_refresh_users_reads_db_and_drops_missing(index_on_sqlite, db):
+    index = index_on_sqlite
+    add_user(db, "a", bio="ajedrez")
+    add_user(db, "b", bio="ajedrez")
+    db.commit()
+    index.upsert(make_user("ghost", bio="ajedrez"))
+
+    index._refresh_users({"a", "b", "ghost"})
+
+    assert index.most_similar("a") == ["b"]
+    assert index.most_similar("ghost") == []
+
+
+# --- Listeners de sesión (vía rápida) ---
+@pytest.fixture
+def enqueued(monkeypatch):
+    calls = []
+    monkeypatch.setattr(similarity_service.profile_index, "enqueue", lambda ids: calls.append(set(ids)))
+    return calls
+
+
+def test_insert_is_enqueued_only_after_commit(db, enqueued):
+    add_user(db, "a", bio="yoga")
+    db.flush()
+    assert enqueued == []
+
+    db.commit()
+    assert enqueued == [{"a"}]
+
+
+def test_text_change_and_delete_are_enqueued(db, enqueued):
+    add_user(db, "a", bio="yoga")
+    db.commit()
+    enqueued.clear()
+
+    db.get(sql_models.User, "a").occupation = "Profesora"
+    db.commit()
+    db.delete(db.get(sql_models.User, "a"))
+    db.commit()
+
+    assert enqueued == [{"a"}, {"a"}]
+
+
+def test_non_text_change_is_not_enqueued(db, enqueued):
+    add_user(db, "a", bio="yoga")
+    db.commit()
+    enqueued.clear()
+
+    db.get(sql_models.User, "a").gift_balance = 10
+    db.commit()
+
+    assert enqueued == []
+
+
+def test_rollback_discards_collected_changes(db, enqueued):
+    add_user(db, "a", bio="yoga")
+    db.commit()
+    enqueued.clear()
+
+    db.get(sql_models.User, "a").bio = "pilates"
+    db.flush()
+    db.rollback()
+    db.commit()
+
+    assert enqueued == []
+
+
+# --- crud y endpoint ---
+def test_get_similar_profiles_keeps_index_order_and_skips_connected(index, db, monkeypatch):
+    add_user(db, "currentUser", bio="senderismo montaña café especialidad")
+    add_user(db, "twin", bio="senderismo montaña café")
+    add_user(db, "half", bio="café por las mañanas")
+    add_user(db, "liked", bio="senderismo montaña café especialidad")
+    add_user(db, "other", bio="videojuegos retro")
+    db.add(sql_models.Connection(user_liking_id="currentUser", user_liked_id="liked", status="liked"))
+    db.commit()
+    index.upsert_many(db.query(sql_models.User).all())
+    monkeypatch.setattr(crud, "profile_index", index)
+
+    result = crud.get_similar_profiles(db, user_id="currentUser", limit=5)
+
+    assert [u.id for u in result][:2] == ["twin", "half"]
+    assert "liked" not in [u.id for u in result]
+    assert "currentUser" not in [u.id for u in result]
+
+
+def test_similar_mode_returns_503_until_index_is_ready(monkeypatch):
+    monkeypatch.setattr(main.profile_index, "ready", False)
+
+    with pytest.raises(HTTPException) as exc:
+        main.get_discovery_matches(mode="similar", limit=5, db=None)
+
+    assert exc.value.status_code == 503
+
+
+def test_rows_freed_while_scoring_are_dropped(index):
+    index.upsert_many([make_user("me", bio="tenis pádel"), make_user("gone", bio="tenis pádel")])
+    state = index._state
+    vectors = state.vectors
+
+    class FreeRowWhileScoring:
+        """Simula que el hilo escritor borra un perfil justo cuando la consulta lee la matriz."""
+        def __getitem__(self, key):
+            if isinstance(key, np.ndarray):
+                index.remove("gone")
+            return vectors[key]
+
+        def __setitem__(self, key, value):
+            vectors[key] = value
+
+    state.vectors = FreeRowWhileScoring()
+
+    assert index.most_similar("me") == []